@@ -0,0 +1,164 @@
+"""CPU cost per response of the hot read endpoints on large listings.
+
+The database is replaced by canned rows so only the API worker's own work is measured. Both the
+pre-optimization handlers (served by a bare FastAPI app, as before) and the current ones are timed
+as full requests through TestClient:
+    python bench_serialization.py --comments 500 --replies 20 --raters 5000
+"""
+import argparse, itertools, json, logging, time
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock, patch
+from uuid import UUID, uuid4
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import main
+
+
+legacy_app = FastAPI()
+
+@legacy_app.get("/comments/{listing_id}")
+async def legacy_get_comments_and_replies(listing_id: UUID):
+    # The handler as it was before: one query per comment, a dict per row, default encoding.
+    with main.connection.cursor() as cursor:
+        listing_data = []
+        cursor.execute("SELECT * FROM Comments WHERE listing_id = %s;", (str(listing_id),))
+        comments = cursor.fetchall()
+        for comment in comments:
+            cursor.execute("SELECT * FROM Replies WHERE comment_id = %s;", (str(comment[0]),))
+            replies = cursor.fetchall()
+            listing_data.append({
+                "comment_id": comment[0],
+                "comment": comment[1],
+                "commenter_email": comment[2],
+                "created_at": comment[4],
+                "replies": [
+                    {"reply_id": reply[0], "reply": reply[1], "commenter_email": reply[2], "created_at": reply[4]}
+                    for reply in replies
+                ]
+            })
+        return {"listing_data": listing_data}
+
+@legacy_app.get("/ratings/user/{user_email}")
+async def legacy_get_user_ratings(user_email: str):
+    with main.connection.cursor() as cursor:
+        cursor.execute("SELECT ... STRING_AGG ... FROM ratings WHERE user_email = %s;", (user_email,))
+        result_set = cursor.fetchone()
+        average_rating, ratings_count, raters_str = result_set[0], result_set[1], result_set[2]
+        raters = [{item.split(':')[0]: int(item.split(':')[1])} for item in raters_str.split(',')] if raters_str else []
+        star_percentages = [round(result_set[i + 3] / ratings_count * 100) if ratings_count != 0 else 0 for i in range(5)]
+        return {
+            "user_id": user_email,
+            "average_rating": float(average_rating) if average_rating is not None else None,
+            "ratings_count": ratings_count,
+            "raters": raters,
+            "star_percentages": star_percentages
+        }
+
+
+def make_rows(comments, replies):
+    created_at = datetime(2024, 1, 1)
+    comment_rows = []
+    reply_rows = {}
+    for i in range(comments):
+        comment_id = str(uuid4())
+        comment_rows.append((comment_id, f"Comment {i} " * 8, f"commenter{i}@example.com", None, created_at + timedelta(minutes=i)))
+        reply_rows[comment_id] = [
+            (str(uuid4()), f"Reply {j} " * 8, f"replier{j}@example.com", comment_id, created_at + timedelta(minutes=i, seconds=j))
+            for j in range(replies)
+        ]
+    return comment_rows, reply_rows
+
+
+def legacy_fetchall(cursor, comment_rows, reply_rows):
+    # Answers the legacy N+1 queries: the listing's comments, then each comment's replies.
+    def fetchall():
+        query, params = cursor.execute.call_args.args
+        return reply_rows[params[0]] if "FROM Replies" in query else comment_rows
+    return fetchall
+
+
+def thread_rows(comment_rows, reply_rows):
+    # The rows get_comments_and_replies reads back for the same listing, one level of replies deep.
+    comments = [(comment[0], comment[1], comment[2], comment[4], len(reply_rows[comment[0]])) for comment in comment_rows]
+    replies = [
+        (reply[0], None, reply[3], reply[1], reply[2], reply[4], 0)
+        for comment in comment_rows
+        for reply in reply_rows[comment[0]]
+    ]
+    return comments, replies
+
+
+def cpu_per_call(func, rounds):
+    func()
+    start = time.process_time()
+    for _ in range(rounds):
+        func()
+    return (time.process_time() - start) / rounds * 1000
+
+
+def bench_endpoint(client, connection, path, encoding, rounds):
+    def call():
+        response = client.get(path, headers={"Accept-Encoding": encoding})
+        assert response.status_code == 200
+        assert response.headers.get("content-encoding", "identity") == encoding
+        return response
+
+    with patch("main.connection", connection):
+        size = int(call().headers["content-length"])
+        return cpu_per_call(call, rounds), size
+
+
+def report(label, client, connection, path, encodings, rounds):
+    for encoding in encodings:
+        ms, size = bench_endpoint(client, connection, path, encoding, rounds)
+        print(f"  {label:<8} {encoding:<8} {ms:8.2f} ms cpu  {size:>9} bytes")
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--comments", type=int, default=500)
+    parser.add_argument("--replies", type=int, default=20, help="replies per comment, all returned in one page")
+    parser.add_argument("--raters", type=int, default=5000)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    client = TestClient(main.app)
+    legacy_client = TestClient(legacy_app)
+    encodings = ("identity", "gzip", "br")
+    comment_rows, reply_rows = make_rows(args.comments, args.replies)
+
+    cursor = MagicMock()
+    cursor.__enter__.return_value = cursor
+    connection = MagicMock()
+    connection.cursor.return_value = cursor
+
+    print(f"GET /comments/{{listing_id}}  {args.comments} comments x {args.replies} replies")
+    cursor.fetchall.side_effect = legacy_fetchall(cursor, comment_rows, reply_rows)
+    report("legacy", legacy_client, connection, f"/comments/{uuid4()}", ("identity",), args.rounds)
+    cursor.fetchall.side_effect = itertools.cycle(thread_rows(comment_rows, reply_rows)).__next__
+    report("current", client, connection, f"/comments/{uuid4()}?limit=100", encodings, args.rounds)
+
+    print(f"GET /ratings/user/{{user_email}}  {args.raters} raters")
+    cursor.fetchone.return_value = [
+        3.0, args.raters, ",".join(f"rater{i}@example.com:{i % 5 + 1}" for i in range(args.raters)),
+        *[args.raters // 5] * 5,
+    ]
+    report("legacy", legacy_client, connection, "/ratings/user/someone@example.com", ("identity",), args.rounds)
+    cursor.fetchone.return_value = (json.dumps({
+        "user_id": "someone@example.com", "average_rating": 3.0, "ratings_count": args.raters,
+        "raters": [{f"rater{i}@example.com": i % 5 + 1} for i in range(args.raters)],
+        "star_percentages": [20, 20, 20, 20, 20],
+    }),)
+    report("current", client, connection, "/ratings/user/someone@example.com", encodings, args.rounds)
+
+    print(f"GET /ratings/user/  {args.raters} users")
+    cursor.fetchall.side_effect = None
+    cursor.fetchall.return_value = [(f"user{i}@example.com", 5) for i in range(args.raters)]
+    report("current", client, connection, "/ratings/user/", encodings, args.rounds)
+
+
+if __name__ == "__main__":
+    main_bench()
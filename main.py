@@ -1,9 +1,19 @@
 from uuid import UUID, uuid4
-import psycopg2, os, logging
-from fastapi import FastAPI, Form, HTTPException, Query
+from datetime import datetime
+from typing import Dict, List, Literal, Optional
+import psycopg2, os, logging, asyncio, time, math
+from fastapi import Depends, FastAPI, Form, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from pydantic import BaseModel
 from dotenv import load_dotenv
 
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:
+    BrotliMiddleware = None
+
 app = FastAPI(debug=True)
 
 app.add_middleware(
@@ -28,17 +38,140 @@ DB_HOST = os.getenv("DB_HOST")
 DB_PORT = os.getenv("DB_PORT")
 DB_DATABASE = os.getenv("DB_DATABASE")
 
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", "5"))
+DB_CONNECT_DEADLINE = float(os.getenv("DB_CONNECT_DEADLINE", "60"))
+DB_CONNECT_INITIAL_DELAY = float(os.getenv("DB_CONNECT_INITIAL_DELAY", "0.5"))
+DB_CONNECT_MAX_DELAY = float(os.getenv("DB_CONNECT_MAX_DELAY", "10"))
+
+# Comma separated libpq DSNs of read replicas; GET endpoints are served from these.
+DB_REPLICA_DSNS = [dsn.strip() for dsn in os.getenv("DB_REPLICA_DSNS", "").split(",") if dsn.strip()]
+DB_REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", "5"))
+DB_REPLICA_LAG_CHECK_INTERVAL = float(os.getenv("DB_REPLICA_LAG_CHECK_INTERVAL", "1"))
+DB_REPLICA_RETRY_INTERVAL = float(os.getenv("DB_REPLICA_RETRY_INTERVAL", "30"))
+READ_YOUR_WRITES_WINDOW = float(os.getenv("READ_YOUR_WRITES_WINDOW", "5"))
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+COMPRESSION_LEVEL = int(os.getenv("COMPRESSION_LEVEL", "5"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))
+MAX_REPLY_DEPTH = int(os.getenv("MAX_REPLY_DEPTH", "10"))
+REPLY_TREE_DEPTH = int(os.getenv("REPLY_TREE_DEPTH", "3"))
+REPLY_PAGE_SIZE = int(os.getenv("REPLY_PAGE_SIZE", "10"))
+REPLY_TREE_BUDGET = int(os.getenv("REPLY_TREE_BUDGET", "100"))
+REPLY_TREE_MAX_ROWS = int(os.getenv("REPLY_TREE_MAX_ROWS", "2000"))
+EVENTS_MAX_WAIT = float(os.getenv("EVENTS_MAX_WAIT", "30"))
+EVENTS_POLL_INTERVAL = float(os.getenv("EVENTS_POLL_INTERVAL", "5"))
+PRIMARY_PIN_COOKIE = "pin_primary_until"
+
+replicas = [{"dsn": dsn, "connection": None, "lag": None, "retry_at": 0.0} for dsn in DB_REPLICA_DSNS]
+next_replica = 0
+replica_monitor = None
+
+events_listener = None
+events_listener_retry_at = 0.0
+events_available = asyncio.Event()
+
+# NULL marks a server that must not take reads: not a standby at all (most likely a wrong DSN)
+# or a standby whose WAL receiver is not streaming from the primary.
+REPLICA_LAG_QUERY = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN NULL
+        WHEN NOT EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming') THEN NULL
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END;
+"""
+
 app = FastAPI()
 
+def add_compression_middleware(app):
+    # Compress responses when the client sends a matching Accept-Encoding. brotli-asgi serves br;
+    # gzip-only clients get the outer GZipMiddleware at COMPRESSION_LEVEL, which passes through
+    # bodies that are already brotli encoded.
+    if BrotliMiddleware is not None:
+        app.add_middleware(BrotliMiddleware, quality=BROTLI_QUALITY, minimum_size=COMPRESSION_MIN_SIZE, gzip_fallback=False)
+    app.add_middleware(GZipMiddleware, minimum_size=COMPRESSION_MIN_SIZE, compresslevel=COMPRESSION_LEVEL)
+
+add_compression_middleware(app)
+
+
+# Declared response models let FastAPI serialize straight to JSON bytes with pydantic-core.
+class UsersOrderedByRating(BaseModel):
+    users_ordered_by_rating: List[str]
+
+class UserRatings(BaseModel):
+    user_id: str
+    average_rating: Optional[float]
+    ratings_count: int
+    raters: List[Dict[str, int]]
+    star_percentages: List[int]
+
+class MoreReplies(BaseModel):
+    comment_id: UUID
+    parent_id: Optional[UUID]
+    offset: int
+    sort: Literal["oldest", "recent", "replies"]
+    limit: int
+
+class Reply(BaseModel):
+    reply_id: UUID
+    parent_id: Optional[UUID]
+    reply: str
+    commenter_email: str
+    created_at: datetime
+    reply_count: int
+    replies: List["Reply"]
+    more_replies: Optional[MoreReplies]
+
+class Comment(BaseModel):
+    comment_id: UUID
+    comment: str
+    commenter_email: str
+    created_at: datetime
+    reply_count: int
+    replies: List[Reply]
+    more_replies: Optional[MoreReplies]
+
+class ListingComments(BaseModel):
+    listing_data: List[Comment]
+
+class ReplyPage(BaseModel):
+    replies: List[Reply]
+    more_replies: Optional[MoreReplies]
+
 @app.on_event("startup")
 async def startup_event():
-    while not connect_db():
-            continue
+    global replica_monitor
+    if not await connect_db_with_retry():
+        raise RuntimeError(f"Could not connect to the database within {DB_CONNECT_DEADLINE}s")
+    await ensure_events_listener()
+    if replicas:
+        replica_monitor = asyncio.create_task(monitor_replicas())
+
+async def connect_db_with_retry(deadline=DB_CONNECT_DEADLINE):
+    # Exponential backoff between attempts, giving up once the deadline has passed
+    # so the orchestrator can restart the container instead of spinning forever.
+    give_up_at = time.monotonic() + deadline
+    delay = DB_CONNECT_INITIAL_DELAY
+    attempt = 1
+    while True:
+        if connect_db():
+            return True
+        remaining = give_up_at - time.monotonic()
+        if remaining <= 0:
+            logger.error(f"Giving up connecting to PostgreSQL after {attempt} attempts")
+            return False
+        sleep_for = min(delay, remaining)
+        logger.info(f"Retrying database connection in {sleep_for:.1f}s (attempt {attempt})")
+        await asyncio.sleep(sleep_for)
+        delay = min(delay * 2, DB_CONNECT_MAX_DELAY)
+        attempt += 1
+
+def open_db_connection():
+    return psycopg2.connect(user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT, database=DB_DATABASE, connect_timeout=DB_CONNECT_TIMEOUT)
 
 def connect_db():
     global connection, cursor
     try:
-        connection = psycopg2.connect(user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT, database=DB_DATABASE)
+        connection = open_db_connection()
 
         cursor = connection.cursor()
         if connection:
@@ -53,12 +186,156 @@ def connect_db():
     except (Exception, psycopg2.Error) as error:
         logger.error(f"Error while connecting to PostgreSQL: {error}")
         return False
+
+def open_events_listener():
+    # Dedicated autocommit connection that LISTENs for outbox inserts and wakes /events/ long-polls.
+    listener = open_db_connection()
+    listener.autocommit = True
+    with listener.cursor() as cursor:
+        cursor.execute("LISTEN events;")
+    return listener
+
+async def ensure_events_listener():
+    # (Re)connects the listener at most once per EVENTS_POLL_INTERVAL; until then /events/ just polls.
+    global events_listener, events_listener_retry_at
+    if events_listener is not None or time.monotonic() < events_listener_retry_at:
+        return
+    events_listener_retry_at = time.monotonic() + EVENTS_POLL_INTERVAL
+    listener = None
+    try:
+        listener = await run_in_threadpool(open_events_listener)
+        fd = listener.fileno()
+        asyncio.get_running_loop().add_reader(fd, on_events_notify, fd)
+    except (Exception, psycopg2.Error) as error:
+        logger.error(f"Error while listening for events, falling back to polling: {error}")
+        if listener is not None:
+            listener.close()
+        return
+    events_listener = listener
+
+def on_events_notify(fd):
+    global events_listener, events_available
+    try:
+        events_listener.poll()
+    except (Exception, psycopg2.Error) as error:
+        logger.error(f"Events listener connection lost, falling back to polling: {error}")
+        asyncio.get_running_loop().remove_reader(fd)
+        events_listener.close()
+        events_listener = None
+        return
+    if events_listener.notifies:
+        events_listener.notifies.clear()
+        # Waiters hold a reference to the old event, so swapping it cannot lose a wakeup.
+        events_available.set()
+        events_available = asyncio.Event()
+
+def refresh_replica(replica, now):
+    # Blocking connect and lag probe; only ever run from monitor_replicas in the threadpool.
+    if replica["connection"] is None and now < replica["retry_at"]:
+        return
+    try:
+        replica_connection = replica["connection"]
+        if replica_connection is None or replica_connection.closed:
+            replica_connection = psycopg2.connect(replica["dsn"], connect_timeout=DB_CONNECT_TIMEOUT)
+            replica_connection.autocommit = True
+        with replica_connection.cursor() as cursor:
+            cursor.execute(REPLICA_LAG_QUERY)
+            lag = cursor.fetchone()[0]
+        replica["connection"] = replica_connection
+        replica["lag"] = float(lag) if lag is not None else None
+        if lag is None:
+            logger.warning("Replica is not a streaming standby, reading from primary")
+        elif replica["lag"] > DB_REPLICA_MAX_LAG:
+            logger.warning(f"Replica lag {replica['lag']:.1f}s exceeds {DB_REPLICA_MAX_LAG}s, reading from primary")
+    except (Exception, psycopg2.Error) as error:
+        logger.error(f"Error while checking read replica: {error}")
+        if replica["connection"] is not None:
+            replica["connection"].close()
+        replica["connection"] = None
+        replica["lag"] = None
+        replica["retry_at"] = now + DB_REPLICA_RETRY_INTERVAL
+
+async def monitor_replicas():
+    while True:
+        for replica in replicas:
+            await run_in_threadpool(refresh_replica, replica, time.monotonic())
+        await asyncio.sleep(DB_REPLICA_LAG_CHECK_INTERVAL)
+
+def pick_replica():
+    # Round robin over replicas, skipping any that are unreachable or lag too far behind.
+    global next_replica
+    for _ in range(len(replicas)):
+        replica = replicas[next_replica % len(replicas)]
+        next_replica += 1
+        if replica["lag"] is not None and replica["lag"] <= DB_REPLICA_MAX_LAG:
+            return replica["connection"]
+    return None
+
+def pinned_to_primary(request: Request):
+    now = time.time()
+    try:
+        pinned_until = float(request.cookies.get(PRIMARY_PIN_COOKIE, 0))
+    except ValueError:
+        return False
+    if not math.isfinite(pinned_until):
+        return False
+    return min(pinned_until, now + READ_YOUR_WRITES_WINDOW) > now
+
+async def get_read_connection(request: Request):
+    if replicas and not pinned_to_primary(request):
+        replica_connection = pick_replica()
+        if replica_connection is not None:
+            return replica_connection
+    return connection
+
+@app.middleware("http")
+async def pin_writers_to_primary(request: Request, call_next):
+    # Read-your-writes: after a write, serve this client's reads from the primary for a short window.
+    response = await call_next(request)
+    if replicas and READ_YOUR_WRITES_WINDOW > 0 and request.method not in ("GET", "HEAD", "OPTIONS"):
+        response.set_cookie(
+            PRIMARY_PIN_COOKIE,
+            str(time.time() + READ_YOUR_WRITES_WINDOW),
+            max_age=math.ceil(READ_YOUR_WRITES_WINDOW),
+            httponly=True,
+        )
+    return response
     
 
 @app.get("/health/")
 async def health():
     return {"status": "Server is healthy"}
 
+@app.get("/health/ready/")
+async def readiness():
+    global connection
+    if connection is None or connection.closed:
+        # Reconnect off the event loop so a down database cannot stall liveness probes;
+        # the schema was already created at startup, so no DDL is re-run here.
+        try:
+            connection = await run_in_threadpool(open_db_connection)
+        except (Exception, psycopg2.Error) as error:
+            logger.error(f"Error while reconnecting to PostgreSQL: {error}")
+            raise HTTPException(status_code=503, detail="Database connection not established")
+    try:
+        # Clear any transaction a failed handler left aborted before probing.
+        connection.rollback()
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1;")
+            cursor.fetchone()
+        connection.rollback()
+    except Exception as e:
+        logger.error(f"Readiness check failed: {e}")
+        try:
+            connection.rollback()
+        except (Exception, psycopg2.Error):
+            # Unusable connection: close it so the next probe reconnects.
+            connection.close()
+        raise HTTPException(status_code=503, detail="Database unavailable")
+    # The database is back, so this is also where a dropped events listener gets re-established.
+    await ensure_events_listener()
+    return {"status": "Server is ready"}
+
 
 #Ratings
 @app.post("/ratings/",  tags=["Ratings"])
@@ -85,7 +362,12 @@ async def create_rating(
                 return HTTPException(status_code=400, detail="Rating for the same user already exists.")
 
             insert_query = """
-                INSERT INTO Ratings (user_email, rater_email, rating) VALUES (%s, %s, %s);
+                WITH created AS (
+                    INSERT INTO Ratings (user_email, rater_email, rating) VALUES (%s, %s, %s)
+                    RETURNING *
+                )
+                INSERT INTO Events (event_type, payload)
+                SELECT 'rating.created', to_jsonb(created) FROM created;
             """
             cursor.execute(insert_query, (user_email, rater_email, rating))
             connection.commit()
@@ -98,8 +380,7 @@ async def create_rating(
         return HTTPException(status_code=500, detail="Internal Server Error")
     
 @app.get("/ratings/",  tags=["Ratings"])
-async def get_rating_id(user_email: str, rater_email: str):
-    global connection
+async def get_rating_id(user_email: str, rater_email: str, connection=Depends(get_read_connection)):
     try:
         with connection.cursor() as cursor:
             query = """
@@ -125,7 +406,12 @@ async def delete_rating(rating_id: UUID):
         with connection.cursor() as cursor:
             
             delete_query = """
-                DELETE FROM Ratings WHERE rating_id = %s;
+                WITH deleted AS (
+                    DELETE FROM Ratings WHERE rating_id = %s
+                    RETURNING *
+                )
+                INSERT INTO Events (event_type, payload)
+                SELECT 'rating.deleted', to_jsonb(deleted) FROM deleted;
             """
             cursor.execute(delete_query, (str(rating_id),))
      
@@ -152,7 +438,12 @@ async def update_rating(
                 return HTTPException(status_code=400, detail="Rating must be between 1 and 5.")
 
             update_query = """
-                UPDATE Ratings SET Rating = %s WHERE rating_id = %s;
+                WITH updated AS (
+                    UPDATE Ratings SET Rating = %s WHERE rating_id = %s
+                    RETURNING *
+                )
+                INSERT INTO Events (event_type, payload)
+                SELECT 'rating.updated', to_jsonb(updated) FROM updated;
             """
             cursor.execute(update_query, (rating, str(rating_id)))
             
@@ -166,8 +457,7 @@ async def update_rating(
         raise HTTPException(status_code=500, detail="Internal Server Error")
     
 @app.get("/ratings/{rating_id}",  tags=["Ratings"])
-async def get_rating(rating_id: UUID):
-    global connection
+async def get_rating(rating_id: UUID, connection=Depends(get_read_connection)):
     try:
         with connection.cursor() as cursor:
             query = "SELECT rating FROM ratings WHERE rating_id = %s;"
@@ -188,9 +478,8 @@ async def get_rating(rating_id: UUID):
         logger.error(f"Error retrieving rating: {str(e)}")
         return HTTPException(status_code=500, detail="Internal Server Error")
 
-@app.get("/ratings/user/",  tags=["Ratings"])
-async def get_ratings_order_by_user():
-    global connection
+@app.get("/ratings/user/",  tags=["Ratings"], response_model=UsersOrderedByRating)
+async def get_ratings_order_by_user(connection=Depends(get_read_connection)):
     try:
         with connection.cursor() as cursor:
             query = """
@@ -208,50 +497,39 @@ async def get_ratings_order_by_user():
         
     except Exception as e:
         logger.error(f"Error retrieving ratings: {e}")
-        return HTTPException(status_code=500, detail="Internal Server Error")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
 
-@app.get("/ratings/user/{user_email}",  tags=["Ratings"])
-async def get_user_ratings(user_email: str):
-    global connection
+@app.get("/ratings/user/{user_email}",  tags=["Ratings"], response_model=UserRatings)
+async def get_user_ratings(user_email: str, connection=Depends(get_read_connection)):
     try:
         with connection.cursor() as cursor:
 
+            # The response document, one object per rater included, is built by PostgreSQL and
+            # passed through as JSON text instead of being parsed and re-encoded here.
             query = """
-                SELECT 
-                    AVG(rating) as average_rating, 
-                    COUNT(*) as ratings_count, 
-                    STRING_AGG(DISTINCT CONCAT(rater_email, ':', Rating), ',') as raters,
-                    COUNT(CASE WHEN rating = 1 THEN 1 ELSE NULL END) as count_1_star,
-                    COUNT(CASE WHEN rating = 2 THEN 1 ELSE NULL END) as count_2_stars,
-                    COUNT(CASE WHEN rating = 3 THEN 1 ELSE NULL END) as count_3_stars,
-                    COUNT(CASE WHEN rating = 4 THEN 1 ELSE NULL END) as count_4_stars,
-                    COUNT(CASE WHEN rating = 5 THEN 1 ELSE NULL END) as count_5_stars
+                SELECT json_build_object(
+                    'user_id', %s::text,
+                    'average_rating', AVG(rating)::float8,
+                    'ratings_count', COUNT(*),
+                    'raters', COALESCE(json_agg(json_build_object(rater_email, rating) ORDER BY rater_email), '[]'::json),
+                    'star_percentages', json_build_array(
+                        COALESCE(ROUND(COUNT(*) FILTER (WHERE rating = 1) * 100.0 / NULLIF(COUNT(*), 0)), 0)::int,
+                        COALESCE(ROUND(COUNT(*) FILTER (WHERE rating = 2) * 100.0 / NULLIF(COUNT(*), 0)), 0)::int,
+                        COALESCE(ROUND(COUNT(*) FILTER (WHERE rating = 3) * 100.0 / NULLIF(COUNT(*), 0)), 0)::int,
+                        COALESCE(ROUND(COUNT(*) FILTER (WHERE rating = 4) * 100.0 / NULLIF(COUNT(*), 0)), 0)::int,
+                        COALESCE(ROUND(COUNT(*) FILTER (WHERE rating = 5) * 100.0 / NULLIF(COUNT(*), 0)), 0)::int
+                    )
+                )::text
                 FROM ratings 
                 WHERE user_email = %s;
             """
-            cursor.execute(query, (user_email,))
-            result_set = cursor.fetchone()
-
-            
-            average_rating = result_set[0]  
-            ratings_count = result_set[1]   
-            raters_str = result_set[2]      
-
-            raters = [{item.split(':')[0]: int(item.split(':')[1])} for item in raters_str.split(',')] if raters_str else []
-
-            star_percentages = [round(result_set[i + 3] / ratings_count * 100) if ratings_count != 0 else 0 for i in range(5)]
-
-            return {
-                "user_id": user_email,
-                "average_rating": float(average_rating) if average_rating is not None else None,
-                "ratings_count": ratings_count,
-                "raters": raters,
-                "star_percentages": star_percentages
-            }
+            cursor.execute(query, (user_email, user_email))
+            user_ratings_json = cursor.fetchone()[0]
+            return Response(content=user_ratings_json, media_type="application/json")
 
     except Exception as e:
         logger.error(f"Error retrieving user ratings information: {e}")
-        return HTTPException(status_code=500, detail="Internal Server Error")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
     
 #Comments
 @app.post("/comments/",  tags=["Comments"])
@@ -260,8 +538,12 @@ async def create_comment(comment: str = Form(...), commenter_email: str = Form(.
     try:
         with connection.cursor() as cursor:
             insert_query = """
-                INSERT INTO Comments (comment, commenter_email, listing_id)
-                VALUES (%s, %s, %s);
+                WITH created AS (
+                    INSERT INTO Comments (comment, commenter_email, listing_id) VALUES (%s, %s, %s)
+                    RETURNING *
+                )
+                INSERT INTO Events (event_type, payload)
+                SELECT 'comment.created', to_jsonb(created) FROM created;
             """
             cursor.execute(insert_query, (comment, commenter_email, str(listing_id)))
             connection.commit()
@@ -270,43 +552,55 @@ async def create_comment(comment: str = Form(...), commenter_email: str = Form(.
         connection.rollback()
         return HTTPException(status_code=500, detail=str(e))
     
-@app.get("/comments/{listing_id}",  tags=["Comments"])
-async def get_comments_and_replies(listing_id: UUID):
-    global connection
+@app.get("/comments/{listing_id}",  tags=["Comments"], response_model=ListingComments)
+async def get_comments_and_replies(
+    listing_id: UUID,
+    max_depth: int = Query(REPLY_TREE_DEPTH, ge=1, le=MAX_REPLY_DEPTH),
+    limit: int = Query(REPLY_PAGE_SIZE, ge=1, le=100),
+    sort: Literal["oldest", "recent", "replies"] = "oldest",
+    connection=Depends(get_read_connection)
+):
     try:
         with connection.cursor() as cursor:
-
-            listing_data = []
             select_query = """
-                SELECT * FROM Comments WHERE listing_id = %s;
+                SELECT c.comment_id, c.comment, c.commenter_email, c.created_at,
+                    (SELECT COUNT(*) FROM Replies r WHERE r.comment_id = c.comment_id AND r.parent_id IS NULL)
+                FROM Comments c
+                WHERE c.listing_id = %s
+                ORDER BY c.created_at;
             """
             cursor.execute(select_query, (str(listing_id),))
             comments = cursor.fetchall()
+
+            rows = []
+            if comments:
+                params = {
+                    "comment_ids": [str(comment[0]) for comment in comments],
+                    "limit": limit,
+                    "offset": 0,
+                    "max_depth": reply_tree_depth(limit, max_depth),
+                    "budget": REPLY_TREE_BUDGET
+                }
+                cursor.execute(reply_tree_query("r.parent_id IS NULL", sort), params)
+                rows = cursor.fetchall()
+            roots = build_reply_tree(rows, sort, limit)
+
+            listing_data = []
             for comment in comments:
-                comment_id = comment[0]
-                select_query = """
-                    SELECT * FROM Replies WHERE comment_id = %s;
-                """
-                cursor.execute(select_query, (str(comment_id),))
-                replies = cursor.fetchall()
+                replies = roots.get(str(comment[0]), [])
                 listing_data.append({
                     "comment_id": comment[0],
                     "comment": comment[1],
                     "commenter_email": comment[2],
-                    "created_at": comment[4],
-                    "replies": [
-                        {
-                            "reply_id": reply[0],
-                            "reply": reply[1],
-                            "commenter_email": reply[2],
-                            "created_at": reply[4]
-                        }
-                        for reply in replies
-                    ]
+                    "created_at": comment[3],
+                    "reply_count": comment[4],
+                    "replies": replies,
+                    "more_replies": more_replies(comment[0], None, comment[4], len(replies), sort, limit)
                 })
             return {"listing_data": listing_data}
     except Exception as e:
-        return HTTPException(status_code=500, detail=str(e))
+        connection.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
     
     
 @app.put("/comments/{comment_id}",  tags=["Comments"])
@@ -315,7 +609,12 @@ async def update_comment(comment_id: str, new_comment: str = Form(...)):
     try:
         with connection.cursor() as cursor:
             update_query = """
-                UPDATE Comments SET Comment = %s WHERE comment_id = %s;
+                WITH updated AS (
+                    UPDATE Comments SET Comment = %s WHERE comment_id = %s
+                    RETURNING *
+                )
+                INSERT INTO Events (event_type, payload)
+                SELECT 'comment.updated', to_jsonb(updated) FROM updated;
             """
             cursor.execute(update_query, (new_comment, comment_id))
             connection.commit()
@@ -329,10 +628,23 @@ async def delete_comment(comment_id: UUID):
     global connection
     try:
         with connection.cursor() as cursor:
+            # Delete the comment's replies in this statement rather than leaving them to
+            # ON DELETE CASCADE, so every removed reply gets its own reply.deleted event.
             delete_query = """
-                DELETE FROM Comments WHERE comment_id = %s;
+                WITH deleted_replies AS (
+                    DELETE FROM Replies WHERE comment_id = %s
+                    RETURNING *
+                ),
+                deleted AS (
+                    DELETE FROM Comments WHERE comment_id = %s
+                    RETURNING *
+                )
+                INSERT INTO Events (event_type, payload)
+                SELECT 'reply.deleted', to_jsonb(deleted_replies) || jsonb_build_object('listing_id', (SELECT listing_id FROM deleted)) FROM deleted_replies
+                UNION ALL
+                SELECT 'comment.deleted', to_jsonb(deleted) FROM deleted;
             """
-            cursor.execute(delete_query, (str(comment_id),))
+            cursor.execute(delete_query, (str(comment_id), str(comment_id)))
             connection.commit()
             return {"message": "Comment deleted successfully"}
     except Exception as e:
@@ -340,16 +652,76 @@ async def delete_comment(comment_id: UUID):
         return HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/comments/{comment_id}/replies",  tags=["Replies"], response_model=ReplyPage)
+async def get_replies(
+    comment_id: UUID,
+    parent_id: Optional[UUID] = None,
+    offset: int = Query(0, ge=0),
+    max_depth: int = Query(REPLY_TREE_DEPTH, ge=1, le=MAX_REPLY_DEPTH),
+    limit: int = Query(REPLY_PAGE_SIZE, ge=1, le=100),
+    sort: Literal["oldest", "recent", "replies"] = "oldest",
+    connection=Depends(get_read_connection)
+):
+    # Continues a thread from a "more_replies" cursor: the replies under parent_id
+    # (or the comment itself) starting at offset, with their own subtrees.
+    try:
+        with connection.cursor() as cursor:
+            parent_condition = "r.parent_id = %(parent_id)s" if parent_id else "r.parent_id IS NULL"
+            params = {
+                "comment_id": str(comment_id),
+                "comment_ids": [str(comment_id)],
+                "parent_id": str(parent_id) if parent_id else None,
+                "limit": limit,
+                "offset": offset,
+                "max_depth": reply_tree_depth(limit, max_depth),
+                "budget": REPLY_TREE_BUDGET
+            }
+
+            count_query = f"""
+                SELECT COUNT(*) FROM Replies r WHERE r.comment_id = %(comment_id)s AND {parent_condition};
+            """
+            cursor.execute(count_query, params)
+            reply_count = cursor.fetchone()[0]
+
+            cursor.execute(reply_tree_query(parent_condition, sort), params)
+            replies = build_reply_tree(cursor.fetchall(), sort, limit).get(str(comment_id), [])
+
+            return {
+                "replies": replies,
+                "more_replies": more_replies(comment_id, parent_id, reply_count, offset + len(replies), sort, limit)
+            }
+    except Exception as e:
+        connection.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.post("/comments/{comment_id}/replies",  tags=["Replies"])
-async def add_reply(comment_id: UUID, commenter_email: str = Form(...), reply: str = Form(...)):
+async def add_reply(comment_id: UUID, commenter_email: str = Form(...), reply: str = Form(...), parent_id: Optional[UUID] = Form(None)):
     global connection
     try:
         with connection.cursor() as cursor:
+            depth = 1
+            if parent_id:
+                check_query = """
+                    SELECT depth FROM Replies WHERE reply_id = %s AND comment_id = %s;
+                """
+                cursor.execute(check_query, (str(parent_id), str(comment_id)))
+                parent = cursor.fetchone()
+
+                if parent is None:
+                    return HTTPException(status_code=404, detail="Parent reply not found.")
+                if parent[0] >= MAX_REPLY_DEPTH:
+                    return HTTPException(status_code=400, detail=f"Replies cannot be nested more than {MAX_REPLY_DEPTH} levels deep.")
+                depth = parent[0] + 1
+
             insert_query = """
-                INSERT INTO Replies (reply, commenter_email, comment_id)
-                VALUES (%s, %s, %s);
+                WITH created AS (
+                    INSERT INTO Replies (reply, commenter_email, comment_id, parent_id, depth) VALUES (%s, %s, %s, %s, %s)
+                    RETURNING *
+                )
+                INSERT INTO Events (event_type, payload)
+                SELECT 'reply.created', to_jsonb(created) || jsonb_build_object('listing_id', (SELECT listing_id FROM Comments WHERE comment_id = created.comment_id)) FROM created;
             """
-            cursor.execute(insert_query, (reply, commenter_email, str(comment_id)))
+            cursor.execute(insert_query, (reply, commenter_email, str(comment_id), str(parent_id) if parent_id else None, depth))
             connection.commit()
             return {"message": "Reply added successfully"}
     except Exception as e:
@@ -362,7 +734,12 @@ async def update_reply(comment_id: UUID, reply_id: UUID, new_reply: str = Form(.
     try:
         with connection.cursor() as cursor:
             update_query = """
-                UPDATE Replies SET reply = %s WHERE reply_id = %s AND comment_id = %s;
+                WITH updated AS (
+                    UPDATE Replies SET reply = %s WHERE reply_id = %s AND comment_id = %s
+                    RETURNING *
+                )
+                INSERT INTO Events (event_type, payload)
+                SELECT 'reply.updated', to_jsonb(updated) || jsonb_build_object('listing_id', (SELECT listing_id FROM Comments WHERE comment_id = updated.comment_id)) FROM updated;
             """
             cursor.execute(update_query, (new_reply, str(reply_id), str(comment_id)))
             connection.commit()
@@ -377,8 +754,20 @@ async def delete_reply(comment_id: UUID, reply_id: UUID):
     global connection
     try:
         with connection.cursor() as cursor:
+            # Delete the whole subtree in this statement rather than leaving it to ON DELETE CASCADE,
+            # so every removed reply gets its own reply.deleted event.
             delete_query = """
-                DELETE FROM Replies WHERE reply_id = %s AND comment_id = %s;
+                WITH RECURSIVE subtree AS (
+                    SELECT reply_id FROM Replies WHERE reply_id = %s AND comment_id = %s
+                  UNION ALL
+                    SELECT r.reply_id FROM Replies r JOIN subtree ON r.parent_id = subtree.reply_id
+                ),
+                deleted AS (
+                    DELETE FROM Replies WHERE reply_id IN (SELECT reply_id FROM subtree)
+                    RETURNING *
+                )
+                INSERT INTO Events (event_type, payload)
+                SELECT 'reply.deleted', to_jsonb(deleted) || jsonb_build_object('listing_id', (SELECT listing_id FROM Comments WHERE comment_id = deleted.comment_id)) FROM deleted;
             """
             cursor.execute(delete_query, (str(reply_id), str(comment_id)))
             connection.commit()
@@ -387,6 +776,170 @@ async def delete_reply(comment_id: UUID, reply_id: UUID):
         connection.rollback()
         return HTTPException(status_code=500, detail=str(e))
 
+
+#Events
+@app.get("/events/",  tags=["Events"])
+async def get_events(
+    after: str = Query("0:0", alias="cursor"),
+    limit: int = Query(100, ge=1, le=1000),
+    wait: float = Query(EVENTS_MAX_WAIT, ge=0, le=EVENTS_MAX_WAIT)
+):
+    global connection
+    try:
+        txid, event_id = (int(part) for part in after.split(":"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    if not (0 <= txid < 2**64 and 0 <= event_id < 2**63):
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+
+    # Ordering by (txid, event_id) and only returning events of transactions older than every
+    # in-flight one guarantees no event can later appear behind a cursor a consumer already holds.
+    query = """
+        SELECT txid::text, event_id, event_type, payload, created_at
+        FROM Events
+        WHERE (txid, event_id) > (%s::xid8, %s)
+            AND txid < pg_snapshot_xmin(pg_current_snapshot())
+        ORDER BY txid, event_id
+        LIMIT %s;
+    """
+    deadline = time.monotonic() + wait
+    try:
+        while True:
+            await ensure_events_listener()
+            waiter = events_available
+            with connection.cursor() as cursor:
+                cursor.execute(query, (str(txid), event_id, limit))
+                rows = cursor.fetchall()
+            connection.rollback()
+
+            remaining = deadline - time.monotonic()
+            if rows or remaining <= 0:
+                break
+            try:
+                await asyncio.wait_for(waiter.wait(), timeout=min(remaining, EVENTS_POLL_INTERVAL))
+            except asyncio.TimeoutError:
+                pass
+
+        if rows:
+            txid, event_id = rows[-1][0], rows[-1][1]
+        return {
+            "events": [
+                {
+                    "event_id": row[1],
+                    "event_type": row[2],
+                    "payload": row[3],
+                    "created_at": row[4]
+                }
+                for row in rows
+            ],
+            "cursor": f"{txid}:{event_id}"
+        }
+    except Exception as e:
+        connection.rollback()
+        logger.error(f"Error retrieving events: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+
+REPLY_ORDER = {
+    "oldest": "created_at, reply_id",
+    "recent": "created_at DESC, reply_id DESC",
+    "replies": "reply_count DESC, created_at DESC, reply_id DESC",
+}
+
+def reply_tree_depth(limit, max_depth):
+    # Deepest level whose worst case, `limit` children under every reply, stays within
+    # REPLY_TREE_MAX_ROWS per comment; deeper replies are reached through more_replies cursors.
+    depth, rows, level_rows = 0, 0, 1
+    while depth < max_depth:
+        level_rows *= limit
+        if rows + level_rows > REPLY_TREE_MAX_ROWS:
+            break
+        rows += level_rows
+        depth += 1
+    return max(depth, 1)
+
+def reply_tree_query(parent_condition, sort):
+    # One recursive query walks the thread breadth first, taking at most `limit` children of
+    # every reply (ordered by `sort`) and stopping at `max_depth` levels below the anchor.
+    # At most `budget` replies are kept per comment, shallowest first; ranking by level and
+    # then `sort` keeps every parent's returned children a prefix of its ordering.
+    order = REPLY_ORDER[sort]
+    node = """
+        SELECT r.reply_id, r.parent_id, r.comment_id, r.reply, r.commenter_email, r.created_at,
+            (SELECT COUNT(*) FROM Replies child WHERE child.parent_id = r.reply_id) AS reply_count
+        FROM Replies r
+    """
+    return f"""
+        WITH RECURSIVE thread AS (
+            SELECT node.*, 1 AS level
+            FROM unnest(%(comment_ids)s::uuid[]) AS root(comment_id)
+            CROSS JOIN LATERAL (
+                {node}
+                WHERE r.comment_id = root.comment_id AND {parent_condition}
+                ORDER BY {order}
+                LIMIT %(limit)s OFFSET %(offset)s
+            ) node
+          UNION ALL
+            SELECT node.*, thread.level + 1
+            FROM thread
+            CROSS JOIN LATERAL (
+                {node}
+                WHERE r.parent_id = thread.reply_id
+                ORDER BY {order}
+                LIMIT %(limit)s
+            ) node
+            WHERE thread.level < %(max_depth)s AND thread.reply_count > 0
+        )
+        SELECT reply_id, parent_id, comment_id, reply, commenter_email, created_at, reply_count
+        FROM (
+            SELECT thread.*, ROW_NUMBER() OVER (PARTITION BY comment_id ORDER BY level, {order}) AS position
+            FROM thread
+        ) ranked
+        WHERE position <= %(budget)s;
+    """
+
+def more_replies(comment_id, parent_id, reply_count, shown, sort, limit):
+    # The cursor carries sort and limit so the offset is applied to the same ordering it came from.
+    if reply_count > shown:
+        return {"comment_id": comment_id, "parent_id": parent_id, "offset": shown, "sort": sort, "limit": limit}
+    return None
+
+def build_reply_tree(rows, sort, limit):
+    # Nests the flat rows of reply_tree_query under their parents and returns the
+    # anchor level keyed by comment_id.
+    replies = {}
+    for row in rows:
+        replies[str(row[0])] = {
+            "reply_id": row[0],
+            "parent_id": row[1],
+            "comment_id": row[2],
+            "reply": row[3],
+            "commenter_email": row[4],
+            "created_at": row[5],
+            "reply_count": row[6],
+            "replies": [],
+            "more_replies": None
+        }
+
+    roots = {}
+    for reply in replies.values():
+        parent = replies.get(str(reply["parent_id"]))
+        siblings = parent["replies"] if parent else roots.setdefault(str(reply["comment_id"]), [])
+        siblings.append(reply)
+
+    if sort == "oldest":
+        sort_key, reverse = (lambda reply: (reply["created_at"], str(reply["reply_id"]))), False
+    elif sort == "recent":
+        sort_key, reverse = (lambda reply: (reply["created_at"], str(reply["reply_id"]))), True
+    else:
+        sort_key, reverse = (lambda reply: (reply["reply_count"], reply["created_at"], str(reply["reply_id"]))), True
+    for siblings in [*roots.values(), *(reply["replies"] for reply in replies.values())]:
+        siblings.sort(key=sort_key, reverse=reverse)
+
+    for reply in replies.values():
+        reply["more_replies"] = more_replies(reply["comment_id"], reply["reply_id"], reply["reply_count"], len(reply["replies"]), sort, limit)
+    return roots
+
     
 def create_tables():
     try:
@@ -430,6 +983,53 @@ def create_tables():
        
         cursor.execute(create_replies_table)
 
+        # Threaded replies: parent_id is NULL for replies directly on the comment.
+        alter_replies_table = """
+        ALTER TABLE Replies ADD COLUMN IF NOT EXISTS parent_id UUID REFERENCES Replies(reply_id) ON DELETE CASCADE;
+        ALTER TABLE Replies ADD COLUMN IF NOT EXISTS depth INT NOT NULL DEFAULT 1;
+        """
+
+        cursor.execute(alter_replies_table)
+
+        create_read_indexes = """
+        CREATE INDEX IF NOT EXISTS comments_listing_id_idx ON Comments (listing_id);
+        CREATE INDEX IF NOT EXISTS replies_comment_id_idx ON Replies (comment_id);
+        CREATE INDEX IF NOT EXISTS replies_parent_id_idx ON Replies (parent_id);
+        CREATE INDEX IF NOT EXISTS ratings_user_email_idx ON Ratings (user_email);
+        """
+
+        cursor.execute(create_read_indexes)
+
+        # Transactional outbox: write handlers insert their change event in the same statement.
+        create_events_table = """
+        CREATE TABLE IF NOT EXISTS Events (
+            event_id BIGSERIAL PRIMARY KEY,
+            txid XID8 NOT NULL DEFAULT pg_current_xact_id(),
+            event_type VARCHAR NOT NULL,
+            payload JSONB NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        CREATE INDEX IF NOT EXISTS events_txid_event_id_idx ON Events (txid, event_id);
+
+        CREATE OR REPLACE FUNCTION notify_events() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('events', '');
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        DO $$
+        BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'events_notify' AND tgrelid = 'events'::regclass) THEN
+                CREATE TRIGGER events_notify AFTER INSERT ON Events
+                    FOR EACH STATEMENT EXECUTE FUNCTION notify_events();
+            END IF;
+        END;
+        $$;
+        """
+
+        cursor.execute(create_events_table)
+
         connection.commit()
         logger.info("Tables created successfully in PostgreSQL database")
     except (Exception, psycopg2.DatabaseError) as error:
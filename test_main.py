@@ -1,5 +1,8 @@
+import asyncio
+import os
 from uuid import uuid4
-from fastapi import HTTPException, Response
+from fastapi import FastAPI, HTTPException, Response
+from fastapi.middleware.gzip import GZipMiddleware
 import pytest
 from fastapi.testclient import TestClient
 from unittest.mock import patch, MagicMock
@@ -195,7 +198,10 @@ def test_get_user_ratings_success(test_client, mock_db_connection):
     mock_connection, mock_cursor = mock_db_connection
     user_email = "test_user@example.com"
 
-    mock_cursor.fetchone.return_value = [4.5, 10, 'rater1@example.com:5,rater2@example.com:4', 1, 2, 3, 3, 1]
+    mock_cursor.fetchone.return_value = (
+        '{"user_id": "test_user@example.com", "average_rating": 4.5, "ratings_count": 10, '
+        '"raters": [{"rater1@example.com": 5}, {"rater2@example.com": 4}], "star_percentages": [10, 20, 30, 30, 10]}',
+    )
     mock_connection.cursor.return_value = mock_cursor
     
     with patch('main.connection', mock_connection):
@@ -211,6 +217,7 @@ def test_get_user_ratings_success(test_client, mock_db_connection):
     
     assert response.status_code == 200
     assert response.json() == expected_response
+    assert mock_cursor.execute.call_args.args[1] == (user_email, user_email)
 
 
 
@@ -235,14 +242,22 @@ def test_create_comment_success(test_client, mock_db_connection):
 
 def test_get_comments_and_replies(mocker, mock_db_connection):
    mock_connection, mock_cursor = mock_db_connection
-   mock_cursor.fetchall.return_value = [("comment_id", "comment", "commenter_email", "created_at"), ("reply_id", "reply", "commenter_email", "created_at")]
+   comment_id = str(uuid4())
+   reply_id = str(uuid4())
+   mock_cursor.fetchall.side_effect = [
+       [(comment_id, "comment", "commenter@example.com", "2024-01-01T00:00:00", 1)],
+       [(reply_id, None, comment_id, "reply", "replier@example.com", "2024-01-01T00:01:00", 0)],
+   ]
    mock_connection.cursor.return_value = mock_cursor
 
    client = TestClient(app)
-   response = client.get("/comments/123e4567-e89b-12d3-a456-426614174000") 
+   with patch('main.connection', mock_connection):
+       response = client.get("/comments/123e4567-e89b-12d3-a456-426614174000") 
 
    assert response.status_code == 200
    assert "listing_data" in response.json()
+   assert response.json()["listing_data"][0]["comment"] == "comment"
+   assert response.json()["listing_data"][0]["replies"][0]["reply_id"] == reply_id
 
 
 
@@ -318,3 +333,562 @@ def test_delete_reply_success(test_client, mock_db_connection):
 
     assert response.status_code == 200
     assert response.json() == {"message": "Reply deleted successfully"}
+
+
+def test_readiness_ready(test_client, mock_db_connection):
+    mock_connection, mock_cursor = mock_db_connection
+    mock_connection.closed = 0
+    mock_connection.cursor.return_value = mock_cursor
+
+    with patch('main.connection', mock_connection):
+        response = test_client.get("/health/ready/")
+
+    assert response.status_code == 200
+    assert response.json() == {"status": "Server is ready"}
+
+
+def test_readiness_not_ready_without_connection(test_client, mocker):
+    mocker.patch("main.open_db_connection", side_effect=Exception("connection refused"))
+    mock_create_tables = mocker.patch("main.create_tables")
+
+    with patch('main.connection', None):
+        response = test_client.get("/health/ready/")
+
+    assert response.status_code == 503
+    mock_create_tables.assert_not_called()
+
+
+def test_readiness_reconnects_without_ddl(test_client, mocker, mock_db_connection):
+    mock_connection, mock_cursor = mock_db_connection
+    mock_connection.closed = 0
+    mock_connection.cursor.return_value = mock_cursor
+    mocker.patch("main.open_db_connection", return_value=mock_connection)
+    mock_create_tables = mocker.patch("main.create_tables")
+
+    with patch('main.connection', None):
+        response = test_client.get("/health/ready/")
+
+    assert response.status_code == 200
+    mock_create_tables.assert_not_called()
+
+
+def test_readiness_database_unavailable(test_client, mock_db_connection):
+    mock_connection, mock_cursor = mock_db_connection
+    mock_connection.closed = 0
+    mock_cursor.execute.side_effect = Exception("server closed the connection unexpectedly")
+    mock_connection.cursor.return_value = mock_cursor
+
+    with patch('main.connection', mock_connection):
+        response = test_client.get("/health/ready/")
+
+    assert response.status_code == 503
+    mock_connection.rollback.assert_called()
+
+
+def test_readiness_closes_connection_it_cannot_roll_back(test_client, mock_db_connection):
+    mock_connection, mock_cursor = mock_db_connection
+    mock_connection.closed = 0
+    mock_connection.rollback.side_effect = Exception("connection already closed")
+    mock_connection.cursor.return_value = mock_cursor
+
+    with patch('main.connection', mock_connection):
+        response = test_client.get("/health/ready/")
+
+    assert response.status_code == 503
+    mock_connection.close.assert_called_once()
+
+
+def test_connect_db_with_retry_gives_up_after_deadline(mocker):
+    mock_connect_db = mocker.patch("main.connect_db", return_value=False)
+    mock_sleep = mocker.patch("main.asyncio.sleep", new_callable=mocker.AsyncMock)
+
+    result = asyncio.run(main.connect_db_with_retry(deadline=0))
+
+    assert result is False
+    assert mock_connect_db.call_count == 1
+    mock_sleep.assert_not_called()
+
+
+def test_connect_db_with_retry_backs_off_exponentially(mocker):
+    mocker.patch("main.connect_db", side_effect=[False, False, False, True])
+    mock_sleep = mocker.patch("main.asyncio.sleep", new_callable=mocker.AsyncMock)
+
+    result = asyncio.run(main.connect_db_with_retry(deadline=60))
+
+    assert result is True
+    assert [call.args[0] for call in mock_sleep.call_args_list] == [0.5, 1.0, 2.0]
+
+
+@pytest.fixture
+def mock_replica():
+    replica_connection = MagicMock()
+    replica_connection.closed = 0
+    replica_cursor = MagicMock()
+    replica_cursor.__enter__.return_value = replica_cursor
+    replica_connection.cursor.return_value = replica_cursor
+    replica = {"dsn": "host=replica", "connection": replica_connection, "lag": 0.0, "retry_at": 0.0}
+
+    with patch('main.replicas', [replica]):
+        yield replica, replica_cursor
+
+
+def test_get_rating_reads_from_replica(test_client, mock_db_connection, mock_replica):
+    mock_connection, mock_cursor = mock_db_connection
+    mock_connection.cursor.return_value = mock_cursor
+    replica, replica_cursor = mock_replica
+    replica_cursor.fetchone.return_value = [3]
+
+    with patch('main.connection', mock_connection):
+        response = test_client.get(f"/ratings/{uuid4()}")
+
+    assert response.json() == {"rating": 3}
+    replica_cursor.execute.assert_called_once()
+    mock_cursor.execute.assert_not_called()
+
+
+def test_write_pins_client_to_primary(test_client, mock_db_connection, mock_replica):
+    mock_connection, mock_cursor = mock_db_connection
+    mock_connection.cursor.return_value = mock_cursor
+    replica, replica_cursor = mock_replica
+    mock_cursor.fetchone.return_value = [5]
+
+    with patch('main.connection', mock_connection):
+        write_response = test_client.put(f"/ratings/{uuid4()}", data={"rating": 5})
+        read_response = test_client.get(f"/ratings/{uuid4()}")
+
+    assert main.PRIMARY_PIN_COOKIE in write_response.cookies
+    assert read_response.json() == {"rating": 5}
+    replica_cursor.execute.assert_not_called()
+
+
+def test_lagging_replica_falls_back_to_primary(test_client, mock_db_connection, mock_replica):
+    mock_connection, mock_cursor = mock_db_connection
+    mock_connection.cursor.return_value = mock_cursor
+    replica, replica_cursor = mock_replica
+    replica_cursor.fetchone.return_value = [main.DB_REPLICA_MAX_LAG + 60]
+    mock_cursor.fetchone.return_value = [2]
+
+    main.refresh_replica(replica, 0.0)
+    with patch('main.connection', mock_connection):
+        response = test_client.get(f"/ratings/{uuid4()}")
+
+    assert response.json() == {"rating": 2}
+    replica_cursor.execute.assert_called_once_with(main.REPLICA_LAG_QUERY)
+
+
+def test_replica_without_wal_stream_is_not_used(mock_replica):
+    replica, replica_cursor = mock_replica
+    replica_cursor.fetchone.return_value = [None]
+
+    main.refresh_replica(replica, 0.0)
+
+    assert replica["lag"] is None
+    assert main.pick_replica() is None
+
+
+def test_unreachable_replica_waits_for_retry(mocker, mock_replica):
+    replica, replica_cursor = mock_replica
+    replica["connection"] = None
+    mock_connect = mocker.patch("main.psycopg2.connect", side_effect=Exception("timeout expired"))
+
+    main.refresh_replica(replica, 100.0)
+    main.refresh_replica(replica, 101.0)
+
+    assert mock_connect.call_count == 1
+    assert replica["retry_at"] == 100.0 + main.DB_REPLICA_RETRY_INTERVAL
+
+
+def test_far_future_pin_cookie_is_clamped(test_client, mock_db_connection, mock_replica):
+    mock_connection, mock_cursor = mock_db_connection
+    mock_connection.cursor.return_value = mock_cursor
+    replica, replica_cursor = mock_replica
+    replica_cursor.fetchone.return_value = [3]
+
+    test_client.cookies.set(main.PRIMARY_PIN_COOKIE, "inf")
+    with patch('main.connection', mock_connection):
+        response = test_client.get(f"/ratings/{uuid4()}")
+
+    assert response.json() == {"rating": 3}
+    mock_cursor.execute.assert_not_called()
+
+
+def test_create_comment_emits_event(test_client, mock_db_connection):
+    mock_connection, mock_cursor = mock_db_connection
+    mock_connection.cursor.return_value = mock_cursor
+
+    form_data = {
+        "comment": "Test comment",
+        "commenter_email": "commenter@example.com",
+        "listing_id": str(uuid4())
+    }
+
+    with patch('main.connection', mock_connection):
+        response = test_client.post("/comments/", data=form_data)
+
+    assert response.json() == {"message": "Comment created successfully"}
+    query = mock_cursor.execute.call_args.args[0]
+    assert "INSERT INTO Events" in query
+    assert "'comment.created'" in query
+    mock_connection.commit.assert_called_once()
+
+
+def test_get_events(test_client, mock_db_connection):
+    mock_connection, mock_cursor = mock_db_connection
+    mock_cursor.fetchall.return_value = [
+        ("740", 12, "rating.created", {"rating": 5}, "2024-01-01T00:00:00"),
+        ("741", 13, "comment.deleted", {"comment": "Bye"}, "2024-01-01T00:00:01"),
+    ]
+    mock_connection.cursor.return_value = mock_cursor
+
+    with patch('main.connection', mock_connection):
+        response = test_client.get("/events/?cursor=739:11")
+
+    assert response.status_code == 200
+    assert response.json()["cursor"] == "741:13"
+    assert [event["event_type"] for event in response.json()["events"]] == ["rating.created", "comment.deleted"]
+    assert mock_cursor.execute.call_args.args[1] == ("739", 11, 100)
+
+
+def test_get_events_times_out_without_events(test_client, mock_db_connection):
+    mock_connection, mock_cursor = mock_db_connection
+    mock_cursor.fetchall.return_value = []
+    mock_connection.cursor.return_value = mock_cursor
+
+    with patch('main.connection', mock_connection):
+        response = test_client.get("/events/?cursor=739:11&wait=0")
+
+    assert response.status_code == 200
+    assert response.json() == {"events": [], "cursor": "739:11"}
+
+
+@pytest.mark.parametrize("cursor", ["latest", "-1:0", "0:-1", f"0:{2**63}", f"{2**64}:0"])
+def test_get_events_invalid_cursor(test_client, cursor):
+    response = test_client.get(f"/events/?cursor={cursor}")
+
+    assert response.status_code == 400
+
+
+def test_get_events_wakes_up_when_an_event_arrives(mocker, mock_db_connection):
+    mock_connection, mock_cursor = mock_db_connection
+    mock_cursor.fetchall.side_effect = [[], [("742", 14, "rating.created", {"rating": 5}, "2024-01-01T00:00:02")]]
+    mock_connection.cursor.return_value = mock_cursor
+    mocker.patch("main.connection", mock_connection)
+    mocker.patch("main.ensure_events_listener", new_callable=mocker.AsyncMock)
+    mocker.patch("main.EVENTS_POLL_INTERVAL", 30)
+
+    async def long_poll():
+        main.events_available = asyncio.Event()
+        request = asyncio.create_task(main.get_events(after="741:13", limit=100, wait=30))
+        await asyncio.sleep(0.05)
+        assert not request.done()
+        main.events_available.set()
+        return await asyncio.wait_for(request, timeout=1)
+
+    result = asyncio.run(long_poll())
+
+    assert result["cursor"] == "742:14"
+    assert mock_cursor.fetchall.call_count == 2
+
+
+def test_on_events_notify_wakes_waiters():
+    listener = MagicMock()
+    listener.notifies = ["events"]
+    event = asyncio.Event()
+
+    with patch("main.events_listener", listener), patch("main.events_available", event):
+        main.on_events_notify(listener.fileno())
+        replacement = main.events_available
+
+    assert event.is_set()
+    assert replacement is not event and not replacement.is_set()
+    assert listener.notifies == []
+
+
+def test_on_events_notify_drops_lost_listener():
+    listener = MagicMock()
+    listener.poll.side_effect = Exception("server closed the connection")
+    loop = MagicMock()
+
+    with patch("main.events_listener", listener), patch("main.asyncio.get_running_loop", return_value=loop):
+        main.on_events_notify(7)
+        assert main.events_listener is None
+
+    loop.remove_reader.assert_called_once_with(7)
+    listener.close.assert_called_once()
+
+
+def test_ensure_events_listener_reconnects_after_loss(mocker):
+    read_fd, write_fd = os.pipe()
+    listener = MagicMock()
+    listener.fileno.return_value = read_fd
+    open_listener = mocker.patch("main.open_events_listener", side_effect=[Exception("connection refused"), listener])
+    mocker.patch("main.events_listener", None)
+    mocker.patch("main.events_listener_retry_at", 0.0)
+    monotonic = mocker.patch("main.time.monotonic", return_value=100.0)
+
+    async def reconnect():
+        await main.ensure_events_listener()
+        assert main.events_listener is None
+        await main.ensure_events_listener()
+        assert open_listener.call_count == 1
+
+        monotonic.return_value = 100.0 + main.EVENTS_POLL_INTERVAL
+        await main.ensure_events_listener()
+        return asyncio.get_running_loop().remove_reader(read_fd)
+
+    try:
+        registered = asyncio.run(reconnect())
+    finally:
+        os.close(read_fd)
+        os.close(write_fd)
+
+    assert main.events_listener is listener
+    assert registered
+
+
+def test_large_response_is_compressed(test_client, mock_db_connection):
+    mock_connection, mock_cursor = mock_db_connection
+    mock_cursor.fetchall.return_value = [(f"user{i}@example.com", 5) for i in range(500)]
+    mock_connection.cursor.return_value = mock_cursor
+
+    with patch('main.connection', mock_connection):
+        response = test_client.get("/ratings/user/", headers={"Accept-Encoding": "gzip"})
+
+    assert response.headers["content-encoding"] == "gzip"
+    assert len(response.json()["users_ordered_by_rating"]) == 500
+
+
+def test_small_response_is_not_compressed(test_client, mock_db_connection):
+    mock_connection, mock_cursor = mock_db_connection
+    mock_cursor.fetchone.return_value = [4]
+    mock_connection.cursor.return_value = mock_cursor
+
+    with patch('main.connection', mock_connection):
+        response = test_client.get(f"/ratings/{uuid4()}", headers={"Accept-Encoding": "gzip"})
+
+    assert "content-encoding" not in response.headers
+
+
+def test_get_comments_builds_reply_tree_with_cursors(test_client, mock_db_connection):
+    mock_connection, mock_cursor = mock_db_connection
+    comment_id, first_id, second_id, nested_id = (str(uuid4()) for _ in range(4))
+    mock_cursor.fetchall.side_effect = [
+        [(comment_id, "comment", "commenter@example.com", "2024-01-01T00:00:00", 3)],
+        [
+            (first_id, None, comment_id, "first", "a@example.com", "2024-01-01T00:01:00", 1),
+            (second_id, None, comment_id, "second", "b@example.com", "2024-01-01T00:02:00", 5),
+            (nested_id, second_id, comment_id, "nested", "c@example.com", "2024-01-01T00:03:00", 2),
+        ],
+    ]
+    mock_connection.cursor.return_value = mock_cursor
+
+    with patch('main.connection', mock_connection):
+        response = test_client.get(f"/comments/{uuid4()}?sort=replies&max_depth=2")
+
+    comment = response.json()["listing_data"][0]
+    assert [reply["reply"] for reply in comment["replies"]] == ["second", "first"]
+    cursor = {"sort": "replies", "limit": main.REPLY_PAGE_SIZE}
+    assert comment["more_replies"] == {"comment_id": comment_id, "parent_id": None, "offset": 2, **cursor}
+
+    second = comment["replies"][0]
+    assert [reply["reply"] for reply in second["replies"]] == ["nested"]
+    assert second["more_replies"] == {"comment_id": comment_id, "parent_id": second_id, "offset": 1, **cursor}
+    assert second["replies"][0]["more_replies"] == {"comment_id": comment_id, "parent_id": nested_id, "offset": 0, **cursor}
+    assert comment["replies"][1]["more_replies"]["parent_id"] == first_id
+
+    thread_query, params = mock_cursor.execute.call_args.args
+    assert "WITH RECURSIVE" in thread_query
+    assert params["max_depth"] == 2
+
+
+def test_get_replies_continues_from_cursor(test_client, mock_db_connection):
+    mock_connection, mock_cursor = mock_db_connection
+    comment_id, parent_id, reply_id = (str(uuid4()) for _ in range(3))
+    mock_cursor.fetchone.return_value = (12,)
+    mock_cursor.fetchall.return_value = [
+        (reply_id, parent_id, comment_id, "reply", "a@example.com", "2024-01-01T00:01:00", 0),
+    ]
+    mock_connection.cursor.return_value = mock_cursor
+
+    with patch('main.connection', mock_connection):
+        response = test_client.get(f"/comments/{comment_id}/replies?parent_id={parent_id}&offset=10&sort=recent&limit=1")
+
+    assert response.status_code == 200
+    assert [reply["reply_id"] for reply in response.json()["replies"]] == [reply_id]
+    assert response.json()["more_replies"] == {"comment_id": comment_id, "parent_id": parent_id, "offset": 11, "sort": "recent", "limit": 1}
+    assert mock_cursor.execute.call_args.args[1]["offset"] == 10
+
+
+def test_add_nested_reply(test_client, mock_db_connection):
+    mock_connection, mock_cursor = mock_db_connection
+    mock_cursor.fetchone.return_value = (2,)
+    mock_connection.cursor.return_value = mock_cursor
+    parent_id = str(uuid4())
+
+    with patch('main.connection', mock_connection):
+        response = test_client.post(
+            f"/comments/{uuid4()}/replies",
+            data={"commenter_email": "reply@example.com", "reply": "Nested", "parent_id": parent_id}
+        )
+
+    assert response.json() == {"message": "Reply added successfully"}
+    assert mock_cursor.execute.call_args.args[1][3:] == (parent_id, 3)
+
+
+def test_add_reply_too_deep(test_client, mock_db_connection):
+    mock_connection, mock_cursor = mock_db_connection
+    mock_cursor.fetchone.return_value = (main.MAX_REPLY_DEPTH,)
+    mock_connection.cursor.return_value = mock_cursor
+
+    with patch('main.connection', mock_connection):
+        response = test_client.post(
+            f"/comments/{uuid4()}/replies",
+            data={"commenter_email": "reply@example.com", "reply": "Too deep", "parent_id": str(uuid4())}
+        )
+
+    assert response.json()["status_code"] == 400
+    mock_connection.commit.assert_not_called()
+
+
+def test_brotli_response_when_accepted(test_client, mock_db_connection):
+    mock_connection, mock_cursor = mock_db_connection
+    mock_cursor.fetchall.return_value = [(f"user{i}@example.com", 5) for i in range(500)]
+    mock_connection.cursor.return_value = mock_cursor
+
+    with patch('main.connection', mock_connection):
+        response = test_client.get("/ratings/user/", headers={"Accept-Encoding": "br"})
+
+    assert response.headers["content-encoding"] == "br"
+
+
+def test_compression_middleware_uses_brotli_when_available(mocker):
+
+    class StubBrotliMiddleware:
+        def __init__(self, app, quality=4, minimum_size=400, gzip_fallback=True):
+            self.app = app
+
+        async def __call__(self, scope, receive, send):
+            await self.app(scope, receive, send)
+
+    mocker.patch("main.BrotliMiddleware", StubBrotliMiddleware)
+    stub_app = FastAPI()
+    main.add_compression_middleware(stub_app)
+
+    @stub_app.get("/")
+    async def root():
+        return {"status": "ok"}
+
+    assert TestClient(stub_app).get("/").json() == {"status": "ok"}
+    gzip_middleware, brotli_middleware = stub_app.user_middleware
+    assert gzip_middleware.cls is GZipMiddleware
+    assert gzip_middleware.kwargs["compresslevel"] == main.COMPRESSION_LEVEL
+    assert brotli_middleware.cls is StubBrotliMiddleware
+    assert brotli_middleware.kwargs == {
+        "quality": main.BROTLI_QUALITY,
+        "minimum_size": main.COMPRESSION_MIN_SIZE,
+        "gzip_fallback": False
+    }
+
+
+def test_compression_middleware_falls_back_to_gzip(mocker):
+
+    mocker.patch("main.BrotliMiddleware", None)
+    stub_app = FastAPI()
+    main.add_compression_middleware(stub_app)
+
+    assert [middleware.cls for middleware in stub_app.user_middleware] == [GZipMiddleware]
+
+
+def test_delete_reply_emits_events_for_subtree(test_client, mock_db_connection):
+    mock_connection, mock_cursor = mock_db_connection
+    mock_connection.cursor.return_value = mock_cursor
+
+    with patch('main.connection', mock_connection):
+        response = test_client.delete(f"/comments/{uuid4()}/replies/{uuid4()}")
+
+    assert response.json() == {"message": "Reply deleted successfully"}
+    query = mock_cursor.execute.call_args.args[0]
+    assert "WITH RECURSIVE subtree" in query
+    assert "DELETE FROM Replies WHERE reply_id IN (SELECT reply_id FROM subtree)" in query
+    assert "'reply.deleted'" in query
+
+
+def test_get_comments_rolls_back_on_error(test_client, mock_db_connection):
+    mock_connection, mock_cursor = mock_db_connection
+    mock_cursor.execute.side_effect = Exception("canceling statement due to statement timeout")
+    mock_connection.cursor.return_value = mock_cursor
+
+    with patch('main.connection', mock_connection):
+        response = test_client.get(f"/comments/{uuid4()}")
+
+    assert response.status_code == 500
+    mock_connection.rollback.assert_called_once()
+
+
+def test_get_replies_rolls_back_on_error(test_client, mock_db_connection):
+    mock_connection, mock_cursor = mock_db_connection
+    mock_cursor.execute.side_effect = Exception("canceling statement due to statement timeout")
+    mock_connection.cursor.return_value = mock_cursor
+
+    with patch('main.connection', mock_connection):
+        response = test_client.get(f"/comments/{uuid4()}/replies")
+
+    assert response.status_code == 500
+    mock_connection.rollback.assert_called_once()
+
+
+def test_gzip_and_brotli_client_gets_brotli(test_client, mock_db_connection):
+    mock_connection, mock_cursor = mock_db_connection
+    mock_cursor.fetchall.return_value = [(f"user{i}@example.com", 5) for i in range(500)]
+    mock_connection.cursor.return_value = mock_cursor
+
+    with patch('main.connection', mock_connection):
+        response = test_client.get("/ratings/user/", headers={"Accept-Encoding": "gzip, br"})
+
+    assert response.headers["content-encoding"] == "br"
+    assert len(response.json()["users_ordered_by_rating"]) == 500
+
+
+def test_reply_tree_depth_bounds_worst_case():
+    assert main.reply_tree_depth(10, 3) == 3
+    assert main.reply_tree_depth(100, 10) == 1
+    assert main.reply_tree_depth(2, 10) == 9
+    assert main.reply_tree_depth(1, 10) == 10
+
+
+def test_get_comments_applies_reply_budget(test_client, mock_db_connection):
+    mock_connection, mock_cursor = mock_db_connection
+    mock_cursor.fetchall.side_effect = [
+        [(str(uuid4()), "comment", "commenter@example.com", "2024-01-01T00:00:00", 0)],
+        [],
+    ]
+    mock_connection.cursor.return_value = mock_cursor
+
+    with patch('main.connection', mock_connection):
+        response = test_client.get(f"/comments/{uuid4()}?limit=100&max_depth=10")
+
+    assert response.status_code == 200
+    thread_query, params = mock_cursor.execute.call_args.args
+    assert "position <= %(budget)s" in thread_query
+    assert params["budget"] == main.REPLY_TREE_BUDGET
+    assert params["max_depth"] == 1
+
+
+def test_delete_comment_emits_events_for_replies(test_client, mock_db_connection):
+    mock_connection, mock_cursor = mock_db_connection
+    mock_connection.cursor.return_value = mock_cursor
+    comment_id = str(uuid4())
+
+    with patch('main.connection', mock_connection):
+        response = test_client.delete(f"/comments/{comment_id}")
+
+    assert response.json() == {"message": "Comment deleted successfully"}
+    query, params = mock_cursor.execute.call_args.args
+    assert "DELETE FROM Replies WHERE comment_id = %s" in query
+    assert "'reply.deleted'" in query and "'comment.deleted'" in query
+    assert params == (comment_id, comment_id)
+
+
+def test_replica_lag_query_rejects_servers_that_are_not_standbys():
+    assert "WHEN NOT pg_is_in_recovery() THEN NULL" in main.REPLICA_LAG_QUERY
+    assert "pg_stat_wal_receiver WHERE status = 'streaming') THEN NULL" in main.REPLICA_LAG_QUERY